@@ -3,6 +3,7 @@
 from pathlib import Path
 from datetime import datetime, timedelta
 import pytz
+import pytest
 
 import weatho
 from weatho.locations import coordinates
@@ -25,6 +26,26 @@ date_utc_1 = utc.localize(datetime(2021, 1, 12))
 date_utc_2 = utc.localize(datetime(2021, 1, 16))
 
 
+class StubSession:
+    """Stand-in for requests.Session, returning predefined response bodies.
+
+    The bodies (bytes) are returned in order, the last one being repeated.
+    """
+
+    def __init__(self, *bodies):
+        self.bodies = list(bodies)
+        self.addresses = []
+        self.closed = False
+
+    def get(self, address, timeout=None):
+        self.addresses.append(address)
+        body = self.bodies.pop(0) if len(self.bodies) > 1 else self.bodies[0]
+        return type('Response', (), {'content': body})
+
+    def close(self):
+        self.closed = True
+
+
 def midnight_of_day(date, source):
     """Return 00:00 of the current date:
     - In CET time if source == 'darksky'
@@ -66,6 +87,28 @@ def test_load_owm():
     assert t0_hourly == t_midnight
 
 
+def test_load_cache():
+    """Loading the same file twice uses cached data, unless cache cleared."""
+    data1 = w_ds.load(date_cet_2, path=datafolder)
+    data2 = w_ds.load(date_cet_2, path=datafolder)
+    weatho.Weather.clear_cache()
+    data3 = w_ds.load(date_cet_2, path=datafolder)
+    assert data1 is data2
+    assert data3 is not data1
+    assert data3 == data1
+
+
+def test_session():
+    """API requests go through the session given to Weather, which is
+    closed when the Weather object is used as a context manager."""
+    session = StubSession(b'{"timezone": "Europe/Paris"}')
+    with weatho.Weather(Lyon, source='owm', session=session) as w:
+        data = w.fetch(date_utc_2)
+    assert session.addresses == [w.url(date_utc_2)]
+    assert data == {'timezone': 'Europe/Paris'}
+    assert session.closed
+
+
 date = date_cet_1
 ndays = 7
 
@@ -86,6 +129,23 @@ def test_missing_days_ndays():
     assert len(mdays) == 2
 
 
+def test_no_day_selected():
+    """Error when date range does not contain any day."""
+    with pytest.raises(ValueError):
+        w_ds.missing_days(date, path=datafolder, until=date - timedelta(days=1))
+
+
+def test_download_retry(tmp_path, monkeypatch):
+    """Day not downloaded at first try (bad API response) is downloaded again."""
+    monkeypatch.setattr(weatho.weather, 'retry_delay', 0)
+    raw = (datafolder / w_ds._generate_filename(date_cet_2)).read_bytes()
+    session = StubSession(b'Error', raw)
+    w = weatho.Weather(Lyon, source='darksky', session=session)
+    w.download(date_cet_2, path=tmp_path)
+    assert len(session.addresses) == 2
+    assert w.missing_days(date_cet_2, path=tmp_path, verbose=False) == []
+
+
 date1 = date_utc_1
 date2 = date_utc_2
 
@@ -101,6 +161,15 @@ def test_hourly_until():
     assert type(data['T'][-1]) is float
 
 
+def test_format_units_owm():
+    """OpenWeatherMap wind speeds (incl. gusts) are converted from m/s to km/h."""
+    record = {'dt': 1610409600, 'wind_speed': 10, 'wind_gust': 20}
+    data = w_ow._format([record], utc)
+    assert data['wind speed'] == [36]
+    assert data['wind gust'] == [72]
+    assert data['rain'] == [0]
+
+
 def test_missing_days_until():
     """Find missing days, using the until argument, with OWM data."""
     date0 = date1 - timedelta(days=2)
@@ -114,3 +183,12 @@ def test_plot():
     data = w_ds.hourly(date=date_cet_1, path=datafolder, until=date_cet_2)
     weatho.plot(data)
     assert True  # is evaluated once the figure is closed
+
+
+def test_plot_missing_values():
+    """Test plotting of hourly data with missing values (None)."""
+    data = w_ow.hourly(date=date_utc_1, path=datafolder, ndays=2)
+    data['RH'][2] = None
+    data['wind direction'][3] = None
+    weatho.plot(data, show=False)
+    assert True
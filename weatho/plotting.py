@@ -1,7 +1,23 @@
 """ Download, analyze and plot weather data DarkSky or OpenWeatherMap API"""
 
 
-import matplotlib.pyplot as plt
+import numpy as np
+
+
+# ============================== Plot settings ===============================
+
+
+# colors of plotted quantities (keys of formatted data)
+colors = {'T': '#c34a47',
+          'RH': '#c4c4cc',
+          'wind speed': '#2d5e46',
+          'wind direction': '#adc3b8',
+          'rain': '#a2c0d0',
+          'clouds': '#3c5a6a'}
+
+# ticks (degrees) and corresponding labels for wind direction
+wind_ticks = (0, 45, 90, 135, 180, 225, 270, 315, 360)
+wind_labels = ('N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW', 'N')
 
 
 # ----------------------------------------------------------------------------
@@ -9,33 +25,32 @@ import matplotlib.pyplot as plt
 # ----------------------------------------------------------------------------
 
 
-def plot(data, title=None):
+def plot(data, title=None, show=True):
     """Plot hourly data of temperature, humidity and wind on a single graph.
 
     Input
     -----
     - formatted data (dict from weather_pt, day, or weather_days)
     - optional title of graph
+    - show: if True (default), call plt.show() to display the figure; use
+      False e.g. to save figures in scripts without displaying them.
 
     Output
     ------
     figure and axes: fig, axa, axb (axa is a tuple of main ax, axb secondary)
     """
+    # imported here so that importing weatho does not load matplotlib
+    import matplotlib.pyplot as plt
+
+    # float arrays converted once, with missing values (None) as NaN
     t = data['t']
-    T = data['T']
-    RH = data['RH']
-    w = data['wind speed']
-    wmax = data['wind gust']
-    wdir = data['wind direction']
-    rain = data['rain']
-    clouds = data['clouds']
-
-    T_color = '#c34a47'
-    RH_color = '#c4c4cc'
-    w_color = '#2d5e46'
-    dir_color = '#adc3b8'
-    rain_color = '#a2c0d0'
-    cloud_color = '#3c5a6a'
+    T = np.array(data['T'], dtype=float)
+    RH = np.array(data['RH'], dtype=float)
+    w = np.array(data['wind speed'], dtype=float)
+    wmax = np.array(data['wind gust'], dtype=float)
+    wdir = np.array(data['wind direction'], dtype=float)
+    rain = np.array(data['rain'], dtype=float)
+    clouds = np.array(data['clouds'], dtype=float)
 
     fig, axs = plt.subplots(1, 3, figsize=(12, 3))
     ax0a, ax1a, ax2a = axs
@@ -45,14 +60,14 @@ def plot(data, title=None):
 
     ax0b = ax0a.twinx()  # share same x axis for T and RH
 
-    ax0b.bar(t, RH, width=0.042, color=RH_color)
-    ax0a.plot(t, T, '.-', color=T_color)
+    ax0b.bar(t, RH, width=0.042, color=colors['RH'])
+    ax0a.plot(t, T, '.-', color=colors['T'])
 
-    ax0a.set_ylabel('T (°C)', color=T_color)
-    ax0a.tick_params(axis='y', labelcolor=T_color)
+    ax0a.set_ylabel('T (°C)', color=colors['T'])
+    ax0a.tick_params(axis='y', labelcolor=colors['T'])
 
-    ax0b.set_ylabel('%RH', color=RH_color)
-    ax0b.tick_params(axis='y', labelcolor=RH_color)
+    ax0b.set_ylabel('%RH', color=colors['RH'])
+    ax0b.tick_params(axis='y', labelcolor=colors['RH'])
 
     ax0a.set_zorder(1)  # to put fist axis in front
     ax0a.patch.set_visible(False)  # to see second axis behind
@@ -64,20 +79,20 @@ def plot(data, title=None):
 
     ax1b = ax1a.twinx()  # same for wind speed and wind direction
 
-    ax1a.plot(t, w, '.-', color=w_color)
-    ax1a.plot(t, wmax, '--', color=w_color)
-    ax1b.bar(t, wdir, width=0.042, color=dir_color)
+    ax1a.plot(t, w, '.-', color=colors['wind speed'])
+    ax1a.plot(t, wmax, '--', color=colors['wind speed'])
+    ax1b.bar(t, wdir, width=0.042, color=colors['wind direction'])
 
     ax1a.set_ylim(0, None)
-    ax1a.set_ylabel('Wind speed (km/h)', color=w_color)
-    ax1a.tick_params(axis='y', labelcolor=w_color)
+    ax1a.set_ylabel('Wind speed (km/h)', color=colors['wind speed'])
+    ax1a.tick_params(axis='y', labelcolor=colors['wind speed'])
 
-    ax1b.set_ylabel('Wind direction', color=dir_color)
-    ax1b.tick_params(axis='y', labelcolor=dir_color)
+    ax1b.set_ylabel('Wind direction', color=colors['wind direction'])
+    ax1b.tick_params(axis='y', labelcolor=colors['wind direction'])
 
     ax1b.set_ylim(0, 360)
-    ax1b.set_yticks([0, 45, 90, 135, 180, 225, 270, 315, 360])
-    ax1b.set_yticklabels(['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW', 'N'])
+    ax1b.set_yticks(wind_ticks)
+    ax1b.set_yticklabels(wind_labels)
 
     ax1a.set_zorder(1)  # to put fist axis in front
     ax1a.patch.set_visible(False)  # to see second axis behind
@@ -87,14 +102,14 @@ def plot(data, title=None):
 
     ax2b = ax2a.twinx()  # same for wind speed and wind direction
 
-    ax2b.bar(t, rain, width=0.042, color=rain_color)
-    ax2a.plot(t, clouds, '.:', color=cloud_color)
+    ax2b.bar(t, rain, width=0.042, color=colors['rain'])
+    ax2a.plot(t, clouds, '.:', color=colors['clouds'])
 
-    ax2a.set_ylabel('Cloud cover (%)', color=cloud_color)
-    ax2a.tick_params(axis='y', labelcolor=cloud_color)
+    ax2a.set_ylabel('Cloud cover (%)', color=colors['clouds'])
+    ax2a.tick_params(axis='y', labelcolor=colors['clouds'])
 
-    ax2b.set_ylabel('Rain (mm/h)', color=rain_color)
-    ax2b.tick_params(axis='y', labelcolor=rain_color)
+    ax2b.set_ylabel('Rain (mm/h)', color=colors['rain'])
+    ax2b.tick_params(axis='y', labelcolor=colors['rain'])
 
     ax2a.set_ylim(0, 100)
 
@@ -117,6 +132,7 @@ def plot(data, title=None):
     fig.autofmt_xdate()
     fig.tight_layout()
 
-    plt.show()
+    if show:
+        plt.show()
 
     return fig, axa, axb
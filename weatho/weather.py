@@ -1,20 +1,27 @@
 """ Download, analyze and plot weather data DarkSky or OpenWeatherMap API"""
 
 
-# TODO: move from threading to concurrent futures?
-
-
 # Standard Library
 from datetime import datetime, timedelta
+import os
 import time
 import json
 from pathlib import Path
 from concurrent import futures
+from functools import lru_cache
 
 # Packages outside standard library
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pytz
 
+# Optional, faster JSON parsing / serializing
+try:
+    import orjson
+except ImportError:  # not installed, or installed but not importable
+    orjson = None
+
 # ======================== info on how data is formatted =====================
 
 
@@ -45,11 +52,87 @@ current_names = {'darksky': 'currently',
 time_names = {'darksky': 'time',
               'owm': 'dt'}
 
+# conversion of raw values (None if missing from data) into formatted values
+
+
+def _to_percent(x):
+    """Humidity & clouds, from 0-1 to 0-100% (DarkSky)"""
+    return None if x is None else 100 * x
+
+
+def _to_kmh(x):
+    """Wind, from m/s to km/h (OpenWeatherMap)"""
+    return None if x is None else 3.6 * x
+
+
+def _rain_1h(x):
+    """Rain is a dict with keys '1h' or '3h' (OpenWeatherMap)"""
+    return 0 if x is None else x['1h']
+
+
+# converters depending on source: {raw data key: conversion function}
+converters = {'darksky': {'humidity': _to_percent,
+                          'cloudCover': _to_percent},
+              'owm': {'wind_speed': _to_kmh,
+                      'wind_gust': _to_kmh,
+                      'rain': _rain_1h}}
+
 # prefixes to filenames for data saving
 prefixes = {'darksky': 'DarkSky',
             'owm': 'OWM'}
 
 
+# ============================ download settings =============================
+
+
+max_threads = 60      # max number of simultaneous downloads in batch downloads
+request_timeout = 10  # (s) before giving up on an API request
+retry_delay = 1       # (s) before 1st retry of download(), doubled at each try
+max_retry_delay = 60  # (s) maximum delay between retries of download()
+max_retries = Retry(total=3, backoff_factor=0.3,  # retries on server errors
+                    status_forcelist=[429, 500, 502, 503, 504])
+
+
+# =============================== JSON tools =================================
+
+
+def _json_loads(raw):
+    """Decode raw JSON bytes into python objects (orjson if available)."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _json_dumps(data, pretty=False):
+    """Encode python objects into JSON bytes (orjson if available).
+
+    If pretty is False, JSON is compact, else it is indented for readability
+    (always with stdlib json, so that the 4-space layout does not depend on
+    whether orjson is installed).
+    """
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=4).encode('utf8')
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf8')
+
+
+# ============================== Misc. tools =================================
+
+
+@lru_cache(maxsize=32)
+def _get_timezone(name):
+    """pytz timezone from its name (e.g. 'Europe/Paris'), cached."""
+    return pytz.timezone(name)
+
+
+@lru_cache(maxsize=1024)
+def _load_file(file, mtime):
+    """Decode .json file (cached; mtime is there so that the cache is
+    not used any more if the file is modified, e.g. re-downloaded)."""
+    return _json_loads(Path(file).read_bytes())
+
+
 # ----------------------------------------------------------------------------
 # ========================== Main Weather Class ==============================
 # ----------------------------------------------------------------------------
@@ -58,7 +141,7 @@ prefixes = {'darksky': 'DarkSky',
 class Weather:
     """Class to manage weather data from DarkSky or OpenWeatherMap"""
 
-    def __init__(self, location, source='darksky', api_key=None):
+    def __init__(self, location, source='darksky', api_key=None, session=None):
         """Init Weather object.
 
         Parameters
@@ -66,22 +149,71 @@ class Weather:
         - location: tuple of (lat, long) coordinates
         - source: 'darksky' (default) or owm (OpenWeatherMap)
         - api_key: str (API key to access DarkSky or OpenWeatherMap)
+        - session: requests.Session used for API requests (optional, by
+          default a session with connection pooling and retries is created)
         """
         self.location = location
         self.source = source
-        self.api_key = api_key
         self.in_names = in_names[source]
+        self._time_name = time_names[source]
+        self._converters = converters[source]
         self.latitude, self.longitude = self.location
+        self.api_key = api_key  # also generates URL templates, see _set_urls()
+
+        # start of filenames for data saving, e.g. 'DarkSky_45.77,4.84'
+        self._filename_base = f'{prefixes[source]}_{self.latitude},{self.longitude}'
+
+        # single HTTP session shared by all (threaded) downloads, so that
+        # connections to the API server are kept alive and reused
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=max_threads, max_retries=max_retries)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def api_key(self):
+        """API key (str) to access DarkSky or OpenWeatherMap."""
+        return self._api_key
+
+    @api_key.setter
+    def api_key(self, value):
+        self._api_key = value
+        self._set_urls()
 
     # ========================== MISC Private Tools ==========================
 
-    def _format_data(self, data, name):
-        """Tool used in _format()."""
-        try:
-            val = data[name]
-        except KeyError:
-            val = None
-        return val
+    def _set_urls(self):
+        """Generate URLs for API requests once, see url().
+
+        self._url_now is the URL for current conditions, and self._url_date
+        the URL template for historical data, where {t} is the unix time.
+        """
+        if self.source == "darksky":
+
+            website = 'https://api.darksky.net/forecast/'
+            base = f'{website}{self.api_key}/{self.latitude},{self.longitude}'
+            units = 'ca'  # (ca units is SI but ensures that wind is in km/h)
+
+            self._url_now = f'{base}?units={units}'
+            self._url_date = f'{base},{{t}}?units={units}'
+
+        elif self.source == "owm":
+
+            website = 'https://api.openweathermap.org/data/2.5/onecall'
+            units = 'metric'  # to have temperature in °C and not K
+
+            self._url_now = f'{website}?lat={self.latitude}&lon={self.longitude}' \
+                            f'&appid={self.api_key}&units={units}'
+
+            self._url_date = f'{website}/timemachine?lat={self.latitude}&units={units}' \
+                             f'&lon={self.longitude}&dt={{t}}&appid={self.api_key}'
 
     def _get_current_time_of_raw_data(self, data):
         """Get aware datetime corresponding to data, depending on source.
@@ -96,7 +228,7 @@ class Weather:
         using the timezone specified in the data.
         """
         try:
-            timezone = pytz.timezone(data['timezone'])
+            timezone = _get_timezone(data['timezone'])
         except KeyError:
             raise KeyError('No timezone information in data, '
                            'probably because of download/API error')
@@ -139,10 +271,7 @@ class Weather:
         - OpenWeatherMap from 0:00 to 23:59 in *UTC* time
         """
         d = self._format_date_for_filenames(date)
-        year, month, day = d.year, d.month, d.day
-        prefix = prefixes[self.source]
-        coord = f'{self.latitude},{self.longitude}'
-        return f'{prefix}_{coord},{year:04d}-{month:02d}-{day:02d}.json'
+        return f'{self._filename_base},{d.year:04d}-{d.month:02d}-{d.day:02d}.json'
 
     @staticmethod
     def _manage_chosen_days(date, until, ndays):
@@ -157,14 +286,48 @@ class Weather:
             pass
         else:
             raise ValueError('Cannot use `until` and `ndays` arguments at the same time')
+        if ndays < 1:
+            raise ValueError('No day selected (`until` before `date`, or `ndays` < 1)')
         dates = [date + timedelta(days=day) for day in range(ndays)]
         return dates
 
-    def _download(self, date, path):
+    def _fetch_raw(self, date=None):
+        """Download data at a specified date (see fetch()).
+
+        Output
+        ------
+        raw, data: JSON bytes as sent by the API, and corresponding decoded data
+        (None, None) if download error
+        """
+        address = self.url(date)
+        try:
+            raw = self.session.get(address, timeout=request_timeout).content
+            data = _json_loads(raw)
+        except Exception:
+            date = datetime.now() if date is None else date
+            date_str = datetime.strftime(date, '%x')
+            print(f'Download error for {date_str}. Please try again.')
+            return None, None
+
+        return raw, data
+
+    def _save(self, data, folder, raw=None, pretty=False):
+        """Save raw data in existing folder (Path object), see save().
+
+        If the JSON bytes of data are already available (raw), they are
+        written as is instead of encoding data again.
+        """
+        date = self._get_current_time_of_raw_data(data)
+        savefile = folder / self._generate_filename(date)
+        savefile.write_bytes(_json_dumps(data, pretty) if raw is None else raw)
+
+    def _download(self, date, folder):
         """Download single day of data (fetch + save). To be threaded."""
-        data = self.fetch(date)
+        raw, data = self._fetch_raw(date)
+        if data is None:  # download error, already reported by _fetch_raw()
+            return
         try:
-            self.save(data, path)
+            self._save(data, folder, raw=raw)
         except KeyError:
             date_str = datetime.strftime(date, '%x')
             print(f'Error for data on {date_str} (e.g. time/timezone missing due '
@@ -178,12 +341,25 @@ class Weather:
         tstart = time.time()
         print(f'Download started in folder {path}')
 
-        with futures.ThreadPoolExecutor(max_workers=60) as executor:
-            for date in dates:
-                executor.submit(self._download, date, path)
+        folder = Path(path)
+        folder.mkdir(parents=True, exist_ok=True)
+
+        nthreads = min(len(dates), max_threads)
+
+        with futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
+            downloads = [executor.submit(self._download, date, folder)
+                         for date in dates]
+            for download in futures.as_completed(downloads):
+                download.result()  # raise unexpected errors, if any
 
         print(f'Download finished in {time.time() - tstart:.2f} seconds.')
 
+    def _fetch_batch(self, dates):
+        """Threaded fetching of whole days of data (list, in order of dates)."""
+        nthreads = min(len(dates), max_threads)
+        with futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
+            return list(executor.map(self.fetch, dates))
+
     def _hourly_data(self, data):
         """Check if there is hourly data in RAW darksky data, if yes return it."""
         try:
@@ -199,40 +375,33 @@ class Weather:
         else:
             return hourly_data
 
-    def _format(self, data, timezone):
-        """
-        Converts raw data into usable data in weatherov (dict of names and values)
-        Used by current() and hourly()
-        """
-        data_out = []
-
-        for dataname in self.in_names:
-
-            # For time, transform into timezone-aware datetime
-            if dataname in time_names.values():
-                unix_time = data[dataname]
-                x = datetime.fromtimestamp(unix_time, timezone)
+    def _format_column(self, records, dataname, timezone):
+        """Formatted values of a single quantity over a list of raw records."""
 
-            # For any other quantity than time, manage when absent from dict
-            else:
-                x = self._format_data(data, dataname)
-
-            # For humidity & clouds, put the value initially in 0-1 in 0-100%
-            if dataname in ['humidity', 'cloudCover'] and x is not None \
-                    and self.source == 'darksky':
-                x = 100 * x
+        # For time, transform into timezone-aware datetime
+        if dataname == self._time_name:
+            return [datetime.fromtimestamp(record[dataname], timezone)
+                    for record in records]
 
-            # for OpenWeatherMap data, units come in m/s
-            if dataname in ['wind_speed', 'wind_guest'] and x is not None:
-                x = 3.6 * x
+        # For any other quantity than time, None when absent from dict
+        values = [record.get(dataname) for record in records]
 
-            # for OpenWeatherMap data, rain is a dict with keys '1h' or '3h'
-            if dataname == 'rain':
-                x = x['1h'] if x is not None else 0
-
-            data_out.append(x)
+        try:  # unit conversion etc. if necessary
+            convert = self._converters[dataname]
+        except KeyError:
+            return values
+        else:
+            return [convert(x) for x in values]
 
-        formatted_data = dict(zip(out_names, data_out))
+    def _format(self, records, timezone):
+        """
+        Converts list of raw data records into usable data in weatho
+        (dict of names and lists of values, one value per record).
+        Used by current() and hourly()
+        """
+        formatted_data = {}
+        for outname, dataname in zip(out_names, self.in_names):
+            formatted_data[outname] = self._format_column(records, dataname, timezone)
         return formatted_data
 
     # ========================= Basic public methods =========================
@@ -250,33 +419,14 @@ class Weather:
         ------
         - URL address (str) where json data can be accessed from in a browser.
         """
-        if self.source == "darksky":
-
-            website = 'https://api.darksky.net/forecast/'
-            base = f'{website}{self.api_key}/{self.latitude},{self.longitude}'
-            units = 'ca'  # (ca units is SI but ensures that wind is in km/h)
-
-            if date is None:  # current conditions
-                address = f'{base}?units={units}'
-            else:
-                t_unix = int(date.timestamp())
-                address = f'{base},{t_unix}?units={units}'
-
-        elif self.source == "owm":
-
-            website = 'https://api.openweathermap.org/data/2.5/onecall'
-            units = 'metric'  # to have temperature in °C and not K
-
-            if date is None:  # current conditions
-                address = f'{website}?lat={self.latitude}&lon={self.longitude}' \
-                          f'&appid={self.api_key}&units={units}'
-
-            else:
-                t_unix = int(date.timestamp())
-                address = f'{website}/timemachine?lat={self.latitude}&units={units}' \
-                          f'&lon={self.longitude}&dt={t_unix}&appid={self.api_key}'
+        if date is None:  # current conditions
+            return self._url_now
+        else:
+            return self._url_date.format(t=int(date.timestamp()))
 
-        return address
+    def close(self):
+        """Close connections to the API server (HTTP session)."""
+        self.session.close()
 
     def fetch(self, date=None):
         """Download weather data at a specified date and return raw data.
@@ -301,18 +451,10 @@ class Weather:
             - DarkSky starts at 0:00 in *local* time,
             - OWM starts at 0:00 in *UTC* time
         """
-        address = self.url(date)
-        try:
-            data = requests.get(address).json()
-        except Exception:
-            date = datetime.now() if date is None else date
-            date_str = datetime.strftime(date, '%x')
-            print(f'Download error for {date_str}. Please try again.')
-            return None
-
+        _, data = self._fetch_raw(date)
         return data
 
-    def save(self, data, path='.'):
+    def save(self, data, path='.', pretty=False):
         """Save raw data gotten from API call (fetch) to .json file.
 
         Parameters
@@ -320,17 +462,12 @@ class Weather:
         - data: raw data (dict) obtained by fetch()
         - path: str or path object of folder in which to save data as .json
         (name of the file is determined automatically from data characteristics)
+        - pretty: if False (default), compact JSON (smaller, faster to write
+          and load); if True, indented JSON, easier to read by humans.
         """
-        date = self._get_current_time_of_raw_data(data)
-        filename = self._generate_filename(date)
-
         foldername = Path(path)
         foldername.mkdir(parents=True, exist_ok=True)
-
-        savefile = foldername / filename
-
-        with open(savefile, 'w', encoding='utf8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        self._save(data, foldername, pretty=pretty)
 
     def load(self, date=None, path='.'):
         """Load raw data (single day) from .json file
@@ -343,14 +480,22 @@ class Weather:
         Output
         ------
         Dictionary of raw data corresponding to the original API call (fetch).
+
+        Note
+        ----
+        Loaded data is cached in memory, so that loading the same file again
+        does not require decoding it again; as a result, the same dictionary
+        is returned by successive calls (copy it before modifying it).
+        Use clear_cache() to empty the cache.
         """
         date = datetime.now() if date is None else date
         file = Path(path) / self._generate_filename(date)
+        return _load_file(str(file), file.stat().st_mtime_ns)
 
-        with open(file, 'r', encoding='utf8') as f:
-            data = json.load(f, )
-
-        return data
+    @staticmethod
+    def clear_cache():
+        """Clear in-memory cache of data loaded from files by load()."""
+        _load_file.cache_clear()
 
     # ================= High-Level Public Methods (raw data )=================
 
@@ -373,22 +518,30 @@ class Weather:
         - ndays (int): total number of days to download, starting at `date`
 
         - ntries is the number of times the program will check for missing data
-          and try to download it again.
+          and try to download it again (waiting 1, 2, 4... seconds between
+          tries, and stopping early if a retry did not download any data).
         """
         dates = self._manage_chosen_days(date, until, ndays)
         self._download_batch(dates, path)
 
         # Check if any missing files, and re-download them if necessary ------
-        for _ in range(ntries):
+        n_missing = None  # number of missing days before last retry
+        for attempt in range(ntries + 1):
             missing_days = self.missing_days(date, path, until=until,
                                              ndays=ndays, verbose=False)
             if len(missing_days) == 0:
+                return
+            # no more tries, or last retry did not download anything after
+            # the previous try failed too (e.g. API key error or data not
+            # available): no need to insist
+            if attempt == ntries or len(missing_days) == n_missing:
                 break
-            else:
-                self.download_missing_days(date, path, until=until,
-                                           ndays=ndays)
-        else:
-            print(f'Warning: could not download missing data after {ntries} tries.')
+            n_missing = len(missing_days)
+            time.sleep(min(max_retry_delay, retry_delay * 2**attempt))
+            self._download_batch(missing_days, path)
+
+        print(f'Warning: could not download {len(missing_days)} missing days '
+              f'after {attempt + 1} tries.')
 
     def missing_days(self, date=None, path='.', until=None, ndays=None, verbose=True):
         """Check for missing days in downloaded data.
@@ -399,12 +552,15 @@ class Weather:
         - verbose: if False, do not print missing day information
         """
         dates = self._manage_chosen_days(date, until, ndays)
-        missing_days = []
 
-        for date in dates:
-            file = Path(path) / self._generate_filename(date)
-            if file.exists() is False:
-                missing_days.append(date)
+        # list folder contents once instead of checking files one by one
+        try:
+            existing_files = {entry.name for entry in os.scandir(path)}
+        except FileNotFoundError:
+            existing_files = set()
+
+        missing_days = [date for date in dates
+                        if self._generate_filename(date) not in existing_files]
 
         if verbose:
 
@@ -448,11 +604,12 @@ class Weather:
         correspond to the weather conditions at time t.
         """
         data = self.fetch(date)
-        timezone = pytz.timezone(data['timezone'])
+        timezone = _get_timezone(data['timezone'])
 
         # Convert raw data to formatted data not dependent on source
         name = current_names[self.source]
-        formatted_data = self._format(data[name], timezone)
+        formatted_records = self._format([data[name]], timezone)
+        formatted_data = {k: values[0] for k, values in formatted_records.items()}
 
         return formatted_data
 
@@ -484,21 +641,21 @@ class Weather:
         for outname in out_names:
             formatted_data[outname] = []
 
-        for date in dates:
+        if path is None:
+            all_data = self._fetch_batch(dates)
+        else:
+            all_data = [self.load(date, path) for date in dates]
+
+        for data in all_data:
 
-            data = self.fetch(date) if path is None else self.load(date, path)
-            timezone = pytz.timezone(data['timezone'])
+            timezone = _get_timezone(data['timezone'])
 
             hourly_data = self._hourly_data(data)
 
             if hourly_data is None:  # if no hourly data, go to next day
-                pass
-            else:
-                for hdata in hourly_data:  # loops over hours of that day
-
-                    fmt_data = self._format(hdata, timezone)
+                continue
 
-                    for outname in out_names:
-                        formatted_data[outname].append(fmt_data[outname])
+            for outname, values in self._format(hourly_data, timezone).items():
+                formatted_data[outname].extend(values)
 
         return formatted_data